@@ -35,9 +35,11 @@ if __name__ == "__main__":
     # below. This includes:
     #
     #     sens : (required) sensitivity setting
-    #     stb_time : (default 9) frequency stabilization wait time (in seconds)
+    #     stb_time : frequency stabilization wait time (in seconds); by
+    #                default scales with the time-constant setting
     #     meas_time : (default 1) time reading data from lock-in's buffer
-    #     ampl_time : (default 5) voltage stabilization wait time
+    #     ampl_time : voltage stabilization wait time; same adaptive
+    #                 default as stb_time
     #     print_progress : (default True) logs measurements by printing each
     #                       result
 
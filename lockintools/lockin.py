@@ -5,13 +5,14 @@ Created on Thu Nov 7, 2019
 """
 
 import serial  # `pyserial` package; NOT `serial` package
-import warnings
 import pandas as pd
 import numpy as np
 import time
 import os
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from pathlib import Path
 
 try:
     from serial.tools import list_ports
@@ -20,7 +21,11 @@ try:
 except ValueError:
     IMPORTED_LIST_PORTS = False
 
-from .options import SETTINGS_DICT
+from .options import SETTINGS_DICT, SENS_VOLTS, OFLT_SECONDS
+
+# settings queried by `LockIn.get_config` (everything but the label map)
+_CONFIG_KEYS = tuple(key for key in SETTINGS_DICT if key != 'names')
+_CONFIG_QUERIES = [key + '?' for key in _CONFIG_KEYS]
 
 # link to usb-serial driver for macOS
 _L1 = "http://www.prolific.com.tw/UserFiles/files/PL2303HXD_G_Driver_v2_0_0_20191204.zip"
@@ -35,6 +40,14 @@ class LockInError(Exception):
     pass
 
 
+def _parse_csv_floats(s):
+    """
+    parse a comma-separated ASCII response (ex: from 'TRCA?') into an
+    array, using numpy's C-level tokenizer instead of a Python loop
+    """
+    return np.fromstring(s.strip().rstrip(','), sep=',')
+
+
 class LockIn(object):
     """
     represents a usable connection with the lock-in amplifier
@@ -42,10 +55,18 @@ class LockIn(object):
     SWEEP_HEADER = "{:>3} \t {:>15} \t {:>15} \t {:>15}"
     SWEEP_BLANK = "{:>3d} \t {:>15,.2f} \t {:>15,.4e} \t {:>15,.4e}"
 
+    # pre-encoded bytes for hot, loop-invariant commands
+    _CMD_REST = b'REST\n'
+    _CMD_STRT = b'STRT\n'
+    _CMD_PAUS = b'PAUS\n'
+    _CMD_SPTS = b'SPTS?\n'
+    _CMD_REST_STRT = b'REST;STRT\n'
+    _CMD_PAUS_SPTS = b'PAUS;SPTS?\n'
+
     @staticmethod
-    def get_serial(comm_port):
+    def get_serial(comm_port, baudrate=19200):
         return serial.Serial(comm_port,
-                             baudrate=19200,
+                             baudrate=baudrate,
                              parity=serial.PARITY_NONE,
                              stopbits=serial.STOPBITS_ONE,
                              bytesize=serial.EIGHTBITS,
@@ -57,38 +78,101 @@ class LockIn(object):
         'linux': ['/dev/ttyUSB0']
     }
 
-    def __init__(self, comm_port: str = None):
+    def __init__(self, comm_port: str = None, baudrate: int = 19200):
         # (detect os and) set communication port
         self._comm = None
         if comm_port is not None:
             try:
-                self._comm = LockIn.get_serial(comm_port)
+                self._comm = LockIn.get_serial(comm_port, baudrate)
             except serial.SerialException:
                 print("lockintools: could not connect to port: %s" % comm_port)
         else:
             print("lockintools: trying default ports for platform: %s" % sys.platform)
             for cp in LockIn.DEFAULT_PORTS[sys.platform]:
                 try:
-                    self._comm = LockIn.get_serial(cp)
+                    self._comm = LockIn.get_serial(cp, baudrate)
                     break
                 except serial.SerialException:
                     print("lockintools: could not connect to port: %s" % cp)
 
             if self._comm is None and IMPORTED_LIST_PORTS:
                 print("lockintools: tying to detect port and auto-connect...")
-                for cp_match in list_ports.grep("(usb|USB)"):
-                    cp_str = str(cp_match).split('-')[0].strip()
+                # one `comports()` enumeration (each call re-walks the OS
+                # device registry) filtered here, using the listed device
+                # path directly
+                for cp_match in list_ports.comports():
+                    fields = '{} {} {}'.format(cp_match.device,
+                                               cp_match.description,
+                                               cp_match.hwid)
+                    if 'usb' not in fields.lower():
+                        continue
                     try:
-                        self._comm = LockIn.get_serial(cp_str)
+                        self._comm = LockIn.get_serial(cp_match.device,
+                                                       baudrate)
                         break
                     except serial.SerialException:
-                        print("lockintools: could not connect to port: %s" % cp_str)
+                        print("lockintools: could not connect to port: %s"
+                              % cp_match.device)
 
         if self._comm is None:
             raise LockInError("lockintools: CONNECTION FAILED! Do you have a driver installed?")
+        self._configure_port()
         print("lockintools: SUCCESS! Connection established.")
         self.print_to_stdout = True
 
+        # last written value per setting, to skip redundant round-trips
+        self._last = {}
+
+        # reusable receive buffer for response lines
+        self._rxbuf = bytearray()
+
+        # encoded commands, cached so repeat commands skip re-encoding
+        self._cmd_cache = {}
+
+        # cached `get_config` result and the time it was taken
+        self._config_cache = None
+        self._config_time = 0.
+
+    def _configure_port(self):
+        """
+        best-effort reduction of OS-level serial latency and buffering;
+        every step silently no-ops where the platform doesn't support it
+        """
+        if sys.platform == 'win32':
+            # enlarge the driver FIFOs so a full buffer dump fits in one read
+            try:
+                self._comm.set_buffer_size(rx_size=1 << 20, tx_size=1 << 16)
+            except (AttributeError, ValueError):
+                pass
+        else:
+            # set ASYNC_LOW_LATENCY so the tty layer delivers bytes as they
+            # arrive instead of coalescing them on a ~10 ms timer
+            try:
+                import array
+                import fcntl
+
+                TIOCGSERIAL = 0x541E
+                TIOCSSERIAL = 0x541F
+                ASYNC_LOW_LATENCY = 1 << 13
+
+                serial_struct = array.array('i', [0] * 64)
+                fcntl.ioctl(self._comm.fd, TIOCGSERIAL, serial_struct, True)
+                serial_struct[4] |= ASYNC_LOW_LATENCY
+                fcntl.ioctl(self._comm.fd, TIOCSSERIAL, serial_struct)
+            except (ImportError, OSError, AttributeError):
+                pass
+
+            # some usb-serial drivers (notably ftdi_sio) accept the ioctl
+            # but silently ignore the flag, so always try their sysfs
+            # latency_timer knob as well
+            try:
+                dev = os.path.basename(self._comm.port)
+                with open('/sys/bus/usb-serial/devices/{}/latency_timer'
+                          .format(dev), 'w') as f:
+                    f.write('1')
+            except (OSError, TypeError):
+                pass
+
     @property
     def comm(self):
         # `serial.Serial` object for handling communications
@@ -106,16 +190,113 @@ class LockIn(object):
 
     def cmd(self, command):
         """execute arbitrary lockin command"""
-        self.comm.write(str.encode(command + '\n'))
-        self.comm.flush()
+        enc = self._cmd_cache.get(command)
+        if enc is None:
+            enc = str.encode(command + '\n')
+            self._cmd_cache[command] = enc
+        self.comm.write(enc)
         if '?' in command:
-            state = bytes.decode(self.comm.readline())
+            # only queries need the transmit buffer drained before we
+            # block on the response; write-only commands can leave the
+            # OS to flush in the background
+            self.comm.flush()
+            state = self._read_line()
             return state
         else:
             return
 
+    def cmd_many(self, commands):
+        """
+        execute several lockin commands as a single serial transaction
+
+        commands are joined with ';' and written once, so the serial
+        round-trip cost is paid one time instead of once per command;
+        returns a list with one response string per query (i.e. per
+        command containing '?'), in order
+        """
+        self.comm.write(str.encode(';'.join(commands) + '\n'))
+        queries = [command for command in commands if '?' in command]
+        if queries:
+            self.comm.flush()
+        return [self._read_line() for _ in queries]
+
+    def _write_raw(self, bts):
+        """write pre-encoded command bytes, skipping string handling"""
+        self.comm.write(bts)
+        self.comm.flush()
+
+    def _read_line(self):
+        """
+        read one response line through a reusable scratch buffer,
+        draining `in_waiting` bytes per call instead of polling the port
+        byte-by-byte the way `readline` does; bytes belonging to a
+        following response are kept in the buffer for the next call
+        """
+        buf = self._rxbuf
+        end = buf.find(b'\n')
+        while end < 0:
+            chunk = self.comm.read(self.comm.in_waiting or 1)
+            if not chunk:
+                break  # timed out; return whatever arrived
+            buf += chunk
+            end = buf.find(b'\n')
+
+        if end < 0:
+            end = len(buf) - 1
+        line = bytes(buf[:end + 1])
+        del buf[:end + 1]
+        return bytes.decode(line)
+
+    def _read_payload(self, n_bytes):
+        """
+        read an `n_bytes` binary payload with the timeout scaled to the
+        transfer time at the current baudrate (10 bits per byte on the
+        wire), so large buffer dumps are not cut short by the port's
+        fixed timeout; raises `LockInError` on an incomplete transfer
+        """
+        old_timeout = self.comm.timeout
+        self.comm.timeout = max(old_timeout,
+                                10. * n_bytes / self.comm.baudrate + 3.)
+        try:
+            buf = self.comm.read(n_bytes)
+        finally:
+            self.comm.timeout = old_timeout
+        if len(buf) != n_bytes:
+            raise LockInError("lockintools: binary transfer returned {} of "
+                              "{} bytes".format(len(buf), n_bytes))
+        return buf
+
+    def read_binary(self, ch, N):
+        """
+        read `N` buffer points from channel `ch` using the lock-in's
+        binary (TRCB) dump; each point arrives as a 4-byte IEEE float,
+        so the transfer is both smaller on the wire than the ASCII
+        (TRCA) format and free of per-sample parsing cost
+        """
+        self.comm.write(str.encode('TRCB?{},0,{}\n'.format(ch, N)))
+        self.comm.flush()
+        buf = self._read_payload(4 * N)
+        # kept as float32: that is the full wire precision, and it halves
+        # the raw-sample memory footprint
+        return np.frombuffer(buf, dtype='<f4')
+
+    def read_binary_xy(self, N):
+        """
+        read `N` buffer points from both channels with the dump commands
+        issued back-to-back, so the 8-byte-per-point payload arrives in
+        one `read` instead of two request/response turnarounds
+        """
+        # each TRCB must be the only command on its line
+        self.comm.write(str.encode('TRCB?1,0,{}\n'.format(N)))
+        self.comm.write(str.encode('TRCB?2,0,{}\n'.format(N)))
+        self.comm.flush()
+        buf = self._read_payload(8 * N)
+        samples = np.frombuffer(buf, dtype='<f4')
+        return samples[:N], samples[N:]
+
     def set_input_mode(self, mode):
         """set lockin input configuration"""
+        self._config_cache = None  # ISRC is part of the config
         if mode == "A":
             self.cmd("ISRC0")
         elif mode == "A-B":
@@ -129,6 +310,7 @@ class LockIn(object):
                              .format(mode))
 
     def set_coupling_mode(self, mode):
+        self._config_cache = None  # ICPL is part of the config
         if mode == "AC":
             self.cmd("ICPL0")
         elif mode == "DC":
@@ -139,20 +321,27 @@ class LockIn(object):
 
     def set_freq(self, freq):
         """set lock-in amp. frequency"""
-        command = 'FREQ' + str(freq)
-        return self.cmd(command)
+        if self._last.get('FREQ') == freq:
+            return
+        self._last['FREQ'] = freq
+        return self.cmd('FREQ' + str(freq))
 
     def set_ampl(self, ampl):
         """set lock-in amp. voltage amplitude"""
         if ampl > 5.:
             raise ValueError("can not exceed amplitude of 5V")
-        command = 'SLVL' + str(ampl)
-        return self.cmd(command)
+        if self._last.get('SLVL') == ampl:
+            return
+        self._last['SLVL'] = ampl
+        return self.cmd('SLVL' + str(ampl))
 
     def set_sens(self, sens):
         """set lock-in amp. sensitivity"""
         if 0 <= sens <= 26:
-            self.cmd('SENS' + str(sens))
+            if self._last.get('SENS') != sens:
+                self._last['SENS'] = sens
+                self._config_cache = None  # SENS is part of the config
+                self.cmd('SENS' + str(sens))
         else:
             raise ValueError("sensitivity setting must be between 0 (1 nV) and "
                              "26 (1 V)")
@@ -161,7 +350,9 @@ class LockIn(object):
         """set lock-in amp. detection harmonic"""
         harm = int(harm)
         if 1 <= harm <= 19999:
-            self.cmd('HARM' + str(harm))
+            if self._last.get('HARM') != harm:
+                self._last['HARM'] = harm
+                self.cmd('HARM' + str(harm))
         else:
             raise ValueError("harmonic must be between 1 and 19999")
 
@@ -173,13 +364,12 @@ class LockIn(object):
         if not (ch == 1 or ch == 2):
             raise ValueError("channel `ch` should be 1 or 2")
 
-        self.cmd("REST")
-        self.cmd("STRT")
+        self._write_raw(LockIn._CMD_REST_STRT)
         time.sleep(meas_time)
-        self.cmd("PAUS")
-        N = self.cmd("SPTS?")
+        self._write_raw(LockIn._CMD_PAUS_SPTS)
+        N = self._read_line().strip()
         r_str = self.cmd("TRCA?" + str(ch) + ",0," + N)
-        r = [float(ri) for ri in r_str.split(',')[:-1]]
+        r = _parse_csv_floats(r_str)
         if stdev:
             return np.mean(r), np.std(r)
         return np.mean(r)
@@ -191,10 +381,9 @@ class LockIn(object):
         return self.get_reading(ch=2, meas_time=meas_time, stdev=stdev)
 
     def sweep(self, label: str, freqs, ampls, sens: int, harm: int,
-              stb_time: float = 9.,
+              stb_time: float = None,
               meas_time: float = 1.,
-              ampl_time: float = 5.,
-              L_MAX: int = 50):
+              ampl_time: float = None):
         """
         Conduct a frequency sweep measurement across one or more voltage
         amplitudes.
@@ -204,10 +393,12 @@ class LockIn(object):
         :param ampls: (scalar or array-like) amplitudes to sweep over
         :param sens: (int) integer indicating lock-in amp. sensitivity setting
         :param harm: (int) detection harmonic
-        :param stb_time: (float) time (s) for stabilization at each freq.
+        :param stb_time: (float) time (s) for stabilization at each freq.;
+                         `None` (default) adapts the wait to the lock-in's
+                         current time-constant setting
         :param meas_time: (float) time (s) for data collection at each freq.
-        :param ampl_time: (float) time (s) for stabilization at each voltage
-        :param L_MAX: (int) maximum data array size
+        :param ampl_time: (float) time (s) for stabilization at each voltage;
+                          `None` (default) adapts as for `stb_time`
         :return: (lockin.SweepData) container of pandas `DataFrame`s for
                  in- and out-of-phase detected voltages, and variances thereof
         """
@@ -215,84 +406,260 @@ class LockIn(object):
         self.set_harm(harm)
         self.set_sens(sens)
 
-        ampls = np.asarray(ampls)
-        freqs = np.asarray(freqs)
+        if stb_time is None or ampl_time is None:
+            # let settling scale with the output filter's time constant
+            # instead of assuming the worst case
+            tc = OFLT_SECONDS[self.cmd('OFLT?').strip()]
+            settle_time = max(5. * tc, meas_time)
+            stb_time = settle_time if stb_time is None else stb_time
+            ampl_time = settle_time if ampl_time is None else ampl_time
 
-        if ampls.ndim == 0:
-            ampls = ampls[None]
+        # single pass to contiguous float64 arrays, scalars promoted
+        ampls = np.atleast_1d(np.ascontiguousarray(ampls, dtype=np.float64))
+        freqs = np.atleast_1d(np.ascontiguousarray(freqs, dtype=np.float64))
 
-        if freqs.ndim == 0:
-            freqs = freqs[None]
+        m = len(ampls)
+        n = len(freqs)
 
-        # buffer arrays for in- and out-of-phase data
-        X = np.full((len(ampls), len(freqs), L_MAX), fill_value=np.nan)
-        Y = np.full((len(ampls), len(freqs), L_MAX), fill_value=np.nan)
+        # every frequency command for the sweep, encoded up front
+        freq_cmds = [str.encode('FREQ' + str(f) + '\n') for f in freqs]
+
+        # raw samples for each sweep point; ragged since the buffer fill
+        # varies point to point (no padded cube, no NaN masking later)
+        X = [[None] * n for _ in range(m)]
+        Y = [[None] * n for _ in range(m)]
+
+        # streaming digest accumulators
+        sum_x = np.zeros((m, n))
+        sumsq_x = np.zeros((m, n))
+        sum_y = np.zeros((m, n))
+        sumsq_y = np.zeros((m, n))
+        counts = np.zeros((m, n), dtype=int)
+
+        # pre-bound locals for the inner loop (skips repeated attribute
+        # lookups on `self` and the `time` module)
+        sleep = time.sleep
+        perf_counter = time.perf_counter
+        write_raw = self._write_raw
+        read_line = self._read_line
+        read_binary_xy = self.read_binary_xy
+        _print = self._printer()
 
         for i, V in enumerate(ampls):
 
-            self._print('V = {:.2f} volts'.format(V))
-            self._print('waiting for stabilization after amplitude change...')
+            _print('V = {:.2f} volts'.format(V))
 
+            # amplitude stabilization only matters if the value changed
+            ampl_changed = self._last.get('SLVL') != V
             self.set_ampl(V)
             self.set_freq(freqs[0])
-            time.sleep(ampl_time)
-
-            self._print('')
-            self._print(LockIn.SWEEP_HEADER.format('', 'freq [Hz]', 'X [V]', 'Y [V]'))
+            if ampl_changed:
+                _print('waiting for stabilization after amplitude '
+                       'change...')
+                sleep(ampl_time)
+
+            # the first point's frequency is already set; start its
+            # stabilization clock now
+            stb_deadline = perf_counter() + stb_time
+
+            # row views for this amplitude, indexed once per amplitude
+            # instead of twice per point
+            Xi = X[i]
+            Yi = Y[i]
+            sum_x_i = sum_x[i]
+            sumsq_x_i = sumsq_x[i]
+            sum_y_i = sum_y[i]
+            sumsq_y_i = sumsq_y[i]
+            counts_i = counts[i]
+
+            _print('')
+            _print(LockIn.SWEEP_HEADER.format('', 'freq [Hz]', 'X [V]', 'Y [V]'))
             for j, freq in enumerate(freqs):
 
-                # self._print("waiting for stabilization at f = {:.4f} Hz "
-                #             "({:d}/{:d})".format(freq, j + 1, len(freqs)))
-
-                self.set_freq(freq)
-                self.cmd('REST')
-                time.sleep(stb_time)
+                # wait out whatever remains of this point's stabilization
+                # window; part of it already elapsed during the previous
+                # point's buffer transfer
+                remaining = stb_deadline - perf_counter()
+                if remaining > 0:
+                    sleep(remaining)
 
                 # self._print('taking measurement')
                 # beep(repeat=1)
-                self.cmd('STRT')
-                time.sleep(meas_time)
-                self.cmd('PAUS')
+                write_raw(LockIn._CMD_REST_STRT)
+                sleep(meas_time)
+                write_raw(LockIn._CMD_PAUS_SPTS)
+                N = int(read_line())
+
+                # step to the next frequency *before* draining the paused
+                # buffer, so the instrument stabilizes during the transfer
+                if j + 1 < n:
+                    write_raw(freq_cmds[j + 1])
+                    self._last['FREQ'] = freqs[j + 1]
+                    stb_deadline = perf_counter() + stb_time
+
+                # values measured at a single point (binary transfer)
+                x, y = read_binary_xy(N)
+
+                Xi[j] = x
+                Yi[j] = y
+
+                counts_i[j] = len(x)
+                # accumulate in float64 even for float32 samples
+                sum_x_i[j] = x.sum(dtype=np.float64)
+                sumsq_x_i[j] = np.square(x, dtype=np.float64).sum()
+                sum_y_i[j] = y.sum(dtype=np.float64)
+                sumsq_y_i[j] = np.square(y, dtype=np.float64).sum()
+
+                _print(LockIn.SWEEP_BLANK.format(j + 1, freq,
+                                                 np.mean(x), np.mean(y)))
+            _print('')
+
+        stats = (sum_x, sumsq_x, sum_y, sumsq_y, counts)
+        return SweepData(X, Y, stats, freqs, ampls, label, sens, harm)
+
+    def sweep_fast(self, label: str, freqs, ampls, sens: int, harm: int,
+                   srate: float = 512.,
+                   n_samples: int = 512,
+                   stb_time: float = 9.,
+                   ampl_time: float = 5.):
+        """
+        Conduct a frequency sweep using the lock-in's FAST2 streaming mode.
 
-                # self._print('extracting values')
-                N = self.cmd('SPTS?')
+        Instead of waiting out `meas_time` and then draining the internal
+        buffer, FAST2 transmits X and Y to the host *as they are sampled*,
+        so each point costs ~`n_samples / srate` seconds with the transfer
+        overlapped with acquisition.
 
-                x_str = self.cmd('TRCA?1,0,' + N)
-                y_str = self.cmd('TRCA?2,0,' + N)
+        :param label: (string) label for the sweep data
+        :param freqs: (scalar or array-like) freqs. to sweep over
+        :param ampls: (scalar or array-like) amplitudes to sweep over
+        :param sens: (int) integer indicating lock-in amp. sensitivity setting
+        :param harm: (int) detection harmonic
+        :param srate: (float) sample rate in Hz; a power of 2 times 62.5 mHz
+        :param n_samples: (int) samples to stream per frequency point
+        :param stb_time: (float) time (s) for stabilization at each freq.
+        :param ampl_time: (float) time (s) for stabilization at each voltage
+        :return: (lockin.SweepData) same container as `sweep` returns
+        """
+        self.set_harm(harm)
+        self.set_sens(sens)
 
-                # list of values measured at a single point
-                # last character is a newline character
-                x = np.array([float(_) for _ in x_str.split(',')[:-1]])
-                y = np.array([float(_) for _ in y_str.split(',')[:-1]])
+        # single pass to contiguous float64 arrays, scalars promoted
+        ampls = np.atleast_1d(np.ascontiguousarray(ampls, dtype=np.float64))
+        freqs = np.atleast_1d(np.ascontiguousarray(freqs, dtype=np.float64))
 
-                try:
-                    X[i, j][:len(x)] = x
-                    Y[i, j][:len(x)] = y
-                except ValueError:
-                    warnings.warn("buffer array overflow encountered at point "
-                                  "f = {:.1f} Hz, V = {:.1f} volts"
-                                  .format(freq, V))
-                    X[i, j] = x[:L_MAX]
-                    Y[i, j] = y[:L_MAX]
-
-                x_ = np.mean(x[~np.isnan(x)])
-                y_ = np.mean(y[~np.isnan(y)])
-                self._print(LockIn.SWEEP_BLANK.format(j + 1, freq, x_, y_))
-            self._print('')
-
-        return SweepData(X, Y, freqs, ampls, label, sens, harm)
-
-    def get_config(self):
-        raw_config = {}
-        for key in SETTINGS_DICT.keys():
-            if key != 'names':
-                raw_config[key] = self.cmd(key + '?')
-        return raw_config
+        srate_code = int(round(np.log2(srate / 0.0625)))
+        if not 0 <= srate_code <= 13:
+            raise ValueError("sample rate must be between 62.5 mHz and 512 Hz")
+        self.cmd('SRAT' + str(srate_code))
+
+        # FAST mode streams X,Y as int16 pairs with full scale = +/- 30000
+        scale = SENS_VOLTS[str(sens)] / 30000.
+        n_bytes = 4 * n_samples
+
+        m = len(ampls)
+        n = len(freqs)
+
+        # same raw-sample and accumulator layout as `sweep`
+        X = [[None] * n for _ in range(m)]
+        Y = [[None] * n for _ in range(m)]
+
+        sum_x = np.zeros((m, n))
+        sumsq_x = np.zeros((m, n))
+        sum_y = np.zeros((m, n))
+        sumsq_y = np.zeros((m, n))
+        counts = np.zeros((m, n), dtype=int)
+
+        _print = self._printer()
+
+        # a streamed point takes n_samples / srate seconds to arrive
+        old_timeout = self.comm.timeout
+        self.comm.timeout = n_samples / srate + 3.
+        try:
+            for i, V in enumerate(ampls):
+
+                _print('V = {:.2f} volts'.format(V))
+                _print('waiting for stabilization after amplitude change...')
+
+                self.set_ampl(V)
+                self.set_freq(freqs[0])
+                time.sleep(ampl_time)
+
+                _print('')
+                _print(LockIn.SWEEP_HEADER.format('', 'freq [Hz]', 'X [V]', 'Y [V]'))
+                for j, freq in enumerate(freqs):
+
+                    self.cmd_many(['FREQ' + str(freq), 'REST'])
+                    self._last['FREQ'] = freq
+                    time.sleep(stb_time)
+
+                    # STRD starts storage (and streaming) after a 0.5 s delay
+                    self.cmd('FAST2;STRD')
+                    buf = self.comm.read(n_bytes)
+
+                    self.cmd_many(['PAUS', 'FAST0'])
+                    time.sleep(0.1)
+                    self.comm.reset_input_buffer()  # drop stray streamed bytes
+
+                    if len(buf) != n_bytes:
+                        raise LockInError(
+                            "lockintools: streamed {} of {} bytes at freq. "
+                            "{} Hz, V = {} (srate={} Hz needs {:.0f} baud or "
+                            "more)".format(len(buf), n_bytes, freq, V,
+                                           srate, 40. * srate))
+
+                    xy = (np.frombuffer(buf, dtype='<i2').reshape(-1, 2)
+                          * np.float32(scale))
+                    x = xy[:, 0]
+                    y = xy[:, 1]
+
+                    X[i][j] = x
+                    Y[i][j] = y
+
+                    counts[i, j] = len(x)
+                    # accumulate in float64 even for float32 samples
+                    sum_x[i, j] = x.sum(dtype=np.float64)
+                    sumsq_x[i, j] = np.square(x, dtype=np.float64).sum()
+                    sum_y[i, j] = y.sum(dtype=np.float64)
+                    sumsq_y[i, j] = np.square(y, dtype=np.float64).sum()
+
+                    _print(LockIn.SWEEP_BLANK.format(j + 1, freq,
+                                                          np.mean(x), np.mean(y)))
+                _print('')
+        finally:
+            self.comm.timeout = old_timeout
+
+        stats = (sum_x, sumsq_x, sum_y, sumsq_y, counts)
+        return SweepData(X, Y, stats, freqs, ampls, label, sens, harm)
+
+    def get_config(self, cache_ttl=60.):
+        """
+        query all settings in a single serial transaction; the result is
+        cached for `cache_ttl` seconds (pass `cache_ttl=0` to force a
+        fresh read from the instrument)
+        """
+        now = time.monotonic()
+        if (self._config_cache is not None
+                and now - self._config_time < cache_ttl):
+            return self._config_cache
+        responses = self.cmd_many(_CONFIG_QUERIES)
+        self._config_cache = dict(zip(_CONFIG_KEYS, responses))
+        self._config_time = now
+        return self._config_cache
 
     def _print(self, s):
         if self.print_to_stdout:
             print(s)
 
+    def _printer(self):
+        """
+        resolve the print-or-suppress branch once, so loops bind either
+        `print` itself or a no-op instead of testing the flag per call
+        """
+        if self.print_to_stdout:
+            return print
+        return lambda s: None
+
 
 class SweepData(object):
     """
@@ -304,10 +671,10 @@ class SweepData(object):
 
     The digested values (ex: `V_x[i]` and `dV_x[i]) at each point are the
     average of many measurements at that point and the variance of those
-    measurements.
+    measurements, computed from running sums accumulated during the sweep.
     """
 
-    def __init__(self, X, Y, freqs, Vs, label, sens, harm):
+    def __init__(self, X, Y, stats, freqs, Vs, label, sens, harm):
         dt1 = datetime.now()
         dt = dt1.strftime("%d-%m-%Y_%H-%M")
         self.ID = '_'.join([label, 'HARM' + str(harm), 'SENS' + str(sens), dt])
@@ -316,37 +683,78 @@ class SweepData(object):
         self.freqs = freqs
         self.Vs = Vs
 
-        # full raw buffer output from lock-in (padded with NaNs)
+        # full raw buffer output from lock-in (ragged lists of arrays)
         self.X = X
         self.Y = Y
 
-        n = len(freqs)
-        m = len(Vs)
+        # digest and DataFrame construction are deferred until first
+        # access, so finishing a sweep does not block on pandas work
+        self._stats = stats
+        self._digest = None
+        self._frames = None
 
-        # initialing arrays for digests
-        V_x = np.zeros((m, n))  # in-phase amplitudes (left lockin display)
-        V_y = np.zeros((m, n))  # out-of-phase amplitudes (right lockin display)
-        dV_x = np.zeros((m, n))  # variances of buffer outputs over time
-        dV_y = np.zeros((m, n))  # variances of buffer output over time
+    def _digest_arrays(self):
+        """
+        compute (once) the digest arrays from the running sums; empty
+        cells divide 0/0 and come out NaN, matching the old masked
+        behavior
+        """
+        if self._digest is None:
+            sum_x, sumsq_x, sum_y, sumsq_y, counts = self._stats
+            # operating on transposed views makes the results come out
+            # (freqs, Vs)-shaped directly: no `.T` copy at frame time
+            counts = counts.T
+            with np.errstate(divide='ignore', invalid='ignore'):
+                V_x = sum_x.T / counts  # in-phase ampls. (left display)
+                V_y = sum_y.T / counts  # out-of-phase (right display)
+                dV_x = np.sqrt(np.maximum(sumsq_x.T / counts - V_x ** 2, 0.))
+                dV_y = np.sqrt(np.maximum(sumsq_y.T / counts - V_y ** 2, 0.))
+            self._digest = (V_x, V_y, dV_x, dV_y)
+        return self._digest
+
+    def _get_frames(self):
+        # converting to DataFrames for readability (lazily, cached);
+        # one shared Index pair spares re-inference for each frame
+        if self._frames is None:
+            index = pd.Index(self.freqs)
+            columns = pd.Index(self.Vs)
+            self._frames = tuple(
+                # the digest arrays are freshly computed and private to
+                # this object, so the frames can wrap them without a copy
+                pd.DataFrame(arr, index=index, columns=columns, copy=False)
+                for arr in self._digest_arrays()
+            )
+        return self._frames
 
-        for i in range(m):
-            for j in range(n):
-                _X_ = X[i, j]
-                _Y_ = Y[i, j]
+    @property
+    def V_x(self):
+        """in-phase amplitudes (left lockin display)"""
+        return self._get_frames()[0]
 
-                _X_ = _X_[~np.isnan(_X_)]
-                _Y_ = _Y_[~np.isnan(_Y_)]
+    @property
+    def V_y(self):
+        """out-of-phase amplitudes (right lockin display)"""
+        return self._get_frames()[1]
 
-                V_x[i, j] = np.mean(_X_)
-                V_y[i, j] = np.mean(_Y_)
-                dV_x[i, j] = np.std(_X_)
-                dV_y[i, j] = np.std(_Y_)
+    @property
+    def dV_x(self):
+        """deviations of in-phase buffer outputs over time"""
+        return self._get_frames()[2]
 
-        # converting to DataFrames for readability
-        self.V_x = pd.DataFrame(V_x.T, index=freqs, columns=Vs)
-        self.V_y = pd.DataFrame(V_y.T, index=freqs, columns=Vs)
-        self.dV_x = pd.DataFrame(dV_x.T, index=freqs, columns=Vs)
-        self.dV_y = pd.DataFrame(dV_y.T, index=freqs, columns=Vs)
+    @property
+    def dV_y(self):
+        """deviations of out-of-phase buffer outputs over time"""
+        return self._get_frames()[3]
+
+    def digest_columns(self, ampl):
+        """
+        return the (V_x, V_y, dV_x, dV_y) digest columns for the drive
+        amplitude `ampl` as plain arrays (one value per frequency),
+        without building any DataFrames
+        """
+        k = int(np.flatnonzero(np.asarray(self.Vs) == ampl)[0])
+        V_x, V_y, dV_x, dV_y = self._digest_arrays()
+        return V_x[:, k], V_y[:, k], dV_x[:, k], dV_y[:, k]
 
 
 class LockInData(object):
@@ -409,28 +817,52 @@ class LockInData(object):
         if self.create_dir is None:
             self.create_dir = 'recorded_' + str(datetime.date(datetime.now()))
 
-        # check if created directory name conflicts with any that already exist
-        name_conflict = True
+        # probe for a free directory name with an integer suffix; no
+        # `os.chdir` (process-global state) and no string surgery on
+        # names that already contain parentheses
+        base = Path(self.working_dir) / self.create_dir
+        path = base
         d = 0
-        os.chdir(self.working_dir)
-        while name_conflict:
+        while True:
             try:
-                os.mkdir(self.create_dir)
-                name_conflict = False
+                path.mkdir()
+                break
             except FileExistsError:
-                if d == 0:
-                    self.create_dir += '(1)'
-                    d += 1
-                else:
-                    self.create_dir = self.create_dir.replace('({})'.format(d),
-                                                              '')
-                    d += 1
-                    self.create_dir += '({})'.format(d)
+                d += 1
+                path = base.with_name('{}({})'.format(base.name, d))
+
+        self.create_dir = path.name
         self.directory_created = True
         self.DIR = '/'.join([self.working_dir, self.create_dir, ''])
 
-    def save_all(self):
+    def save_all(self, fmt='csv'):
+        """
+        save every recorded sweep to disk
+
+        :param fmt: (string) 'csv' (default; fast plain-text files) or
+                    'xlsx' (slower, one workbook per channel as before)
+        """
+        if fmt not in ('csv', 'xlsx'):
+            raise ValueError("format '{}' is not 'csv' or 'xlsx'".format(fmt))
+
         self.init_save()
+
+        def _write_csv(sweep_data, V_x_base, V_y_base):
+            sweep_data.V_x.to_csv(V_x_base + '.csv')
+            sweep_data.dV_x.to_csv(V_x_base + '.error.csv')
+            sweep_data.V_y.to_csv(V_y_base + '.csv')
+            sweep_data.dV_y.to_csv(V_y_base + '.error.csv')
+
+        def _write_xlsx(sweep_data, V_x_base, V_y_base):
+            # one workbook per sweep: both channels, four sheets
+            with pd.ExcelWriter(V_x_base + '.xlsx') as writer:
+                sweep_data.V_x.to_excel(writer, sheet_name='V_x')
+                sweep_data.dV_x.to_excel(writer, sheet_name='dV_x')
+                sweep_data.V_y.to_excel(writer, sheet_name='V_y')
+                sweep_data.dV_y.to_excel(writer, sheet_name='dV_y')
+
+        # recall each `sweep_data` is an instance of `SweepData`
+        tasks = []
         for name, sweep_data in zip(['Vs_3w', 'Vs_1w', 'Vsh_1w'],
                                     [self.Vs_3w, self.Vs_1w, self.Vsh_1w]):
 
@@ -438,21 +870,19 @@ class LockInData(object):
             if sweep_data is None:
                 continue
 
-            # recall each `Data` is an instance of `SweepData`
-            V_x_file_path = (self.DIR
-                             + '_'.join(['{}'.format(name), sweep_data.ID])
-                             + '.xlsx')
-            V_y_file_path = (self.DIR
-                             + '_'.join(['{}_o'.format(name), sweep_data.ID])
-                             + '.xlsx')
-
-            with pd.ExcelWriter(V_x_file_path) as writer:
-                sweep_data.V_x.to_excel(writer, sheet_name='val')
-                sweep_data.dV_x.to_excel(writer, sheet_name='var')
+            V_x_base = self.DIR + '_'.join(['{}'.format(name), sweep_data.ID])
+            V_y_base = self.DIR + '_'.join(['{}_o'.format(name),
+                                            sweep_data.ID])
+            tasks.append((sweep_data, V_x_base, V_y_base))
 
-            with pd.ExcelWriter(V_y_file_path) as writer:
-                sweep_data.V_y.to_excel(writer, sheet_name='val')
-                sweep_data.dV_y.to_excel(writer, sheet_name='var')
+        if tasks:
+            # the sweeps' files are independent and serialization releases
+            # the GIL around file I/O, so write them in parallel
+            write = _write_csv if fmt == 'csv' else _write_xlsx
+            with ThreadPoolExecutor(max_workers=len(tasks)) as pool:
+                futures = [pool.submit(write, *task) for task in tasks]
+                for future in futures:
+                    future.result()
 
         print("saved sweep data in '{}'".format(self.DIR))
 
@@ -464,58 +894,56 @@ class LockInData(object):
                 raise ValueError("no recorded data for attribute '{}'"
                                  .format(name))
 
-        if not (np.all(self.Vs_1w.freqs == self.Vs_3w.freqs)
-                and np.all(self.Vs_1w.freqs == self.Vsh_1w.freqs)):
+        if not (np.array_equal(self.Vs_1w.freqs, self.Vs_3w.freqs)
+                and np.array_equal(self.Vs_1w.freqs, self.Vsh_1w.freqs)):
             raise IndexError("frequencies don't match across scans")
 
-        if not (ampl in self.Vs_1w.Vs and ampl in self.Vs_3w.Vs
-                and ampl in self.Vsh_1w.Vs):
+        # one hashed lookup against the scans' common amplitudes instead
+        # of three linear scans through the arrays
+        common_Vs = (set(map(float, self.Vs_1w.Vs))
+                     & set(map(float, self.Vs_3w.Vs))
+                     & set(map(float, self.Vsh_1w.Vs)))
+        if float(ampl) not in common_Vs:
             raise ValueError("specified voltage not found in every scan")
 
-        # unpack DataFrames into arrays
-        # values
-        _Vs_3w = self.Vs_3w.V_x[ampl].values
-        _Vs_1w = self.Vs_1w.V_x[ampl].values
-        _Vsh_1w = self.Vsh_1w.V_x[ampl].values
-        _Vs_3w_o = self.Vs_3w.V_y[ampl].values
-        _Vs_1w_o = self.Vs_1w.V_y[ampl].values
-        _Vsh_1w_o = self.Vsh_1w.V_y[ampl].values
-        # standard deviation of values
-        _dVs_3w = self.Vs_3w.dV_x[ampl].values
-        _dVs_1w = self.Vs_1w.dV_x[ampl].values
-        _dVsh_1w = self.Vsh_1w.dV_x[ampl].values
-        _dVs_3w_o = self.Vs_3w.dV_y[ampl].values
-        _dVs_1w_o = self.Vs_3w.dV_y[ampl].values
-        _dVsh_1w_o = self.Vsh_1w.dV_y[ampl].values
+        # unpack digests into per-column arrays (no DataFrames involved)
+        _Vs_3w, _Vs_3w_o, _dVs_3w, _dVs_3w_o = \
+            self.Vs_3w.digest_columns(ampl)
+        _Vs_1w, _Vs_1w_o, _dVs_1w, _dVs_1w_o = \
+            self.Vs_1w.digest_columns(ampl)
+        _Vsh_1w, _Vsh_1w_o, _dVsh_1w, _dVsh_1w_o = \
+            self.Vsh_1w.digest_columns(ampl)
+
+        freqs = self.Vs_1w.freqs
 
         # write voltage values
-        V_output = np.array([_Vs_3w, _Vs_3w_o,
-                             _Vs_1w, _Vs_1w_o,
-                             _Vsh_1w, _Vsh_1w_o])
-        V_columns = ['Vs_3w', 'Vs_3w_o',
+        V_columns = ['freq',
+                     'Vs_3w', 'Vs_3w_o',
                      'Vs_1w', 'Vs_1w_o',
                      'Vsh_1w', 'Vsh_1w_o']
-
-        V_output_df = pd.DataFrame(V_output.T, columns=V_columns)
-        V_output_df.insert(0, 'freq', self.Vs_1w.freqs)
+        V_output = np.column_stack([freqs,
+                                    _Vs_3w, _Vs_3w_o,
+                                    _Vs_1w, _Vs_1w_o,
+                                    _Vsh_1w, _Vsh_1w_o])
 
         V_file = self.DIR + 'tc3omega_data_{}_V'.format(ampl) + '.csv'
-        V_output_df.to_csv(V_file, index=False)
+        np.savetxt(V_file, V_output, delimiter=',', comments='',
+                   header=','.join(V_columns))
         self._V_file = V_file
         print("saved tc3omega digest in '{}'".format(self.DIR))
 
         # write voltage errors
-        dV_output = np.array([_dVs_3w, _dVs_3w_o,
-                              _dVs_1w, _dVs_1w_o,
-                              _dVsh_1w, _dVsh_1w_o])
-        dV_columns = ['dVs_3w', 'dVs_3w_o',
+        dV_columns = ['freq',
+                      'dVs_3w', 'dVs_3w_o',
                       'dVs_1w', 'dVs_1w_o',
                       'dVsh_1w', 'dVsh_1w_o']
-
-        dV_output_df = pd.DataFrame(dV_output.T, columns=dV_columns)
-        dV_output_df.insert(0, 'freq', self.Vs_1w.freqs)
+        dV_output = np.column_stack([freqs,
+                                     _dVs_3w, _dVs_3w_o,
+                                     _dVs_1w, _dVs_1w_o,
+                                     _dVsh_1w, _dVsh_1w_o])
 
         dV_file = self.DIR + 'tc3omega_data_{}_V'.format(ampl) + '.error.csv'
-        dV_output_df.to_csv(dV_file, index=False)
+        np.savetxt(dV_file, dV_output, delimiter=',', comments='',
+                   header=','.join(dV_columns))
         self._dV_file = dV_file
         print("saved tc3omega error digest in '{}'".format(self.DIR))
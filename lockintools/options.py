@@ -49,6 +49,17 @@ SENS = {
     '26': '1 V/uA'
 }
 
+# sensitivity settings as full-scale voltages (voltage-input modes)
+_SENS_PREFIXES = {'nV': 1e-9, 'uV': 1e-6, 'mV': 1e-3, 'V': 1.0}
+
+
+def _sens_volts(label):
+    value, units = label.split()
+    return float(value) * _SENS_PREFIXES[units.split('/')[0]]
+
+
+SENS_VOLTS = {key: _sens_volts(label) for key, label in SENS.items()}
+
 # dynamic reserve mode
 RMOD = {
     '0': 'HIGH RESERVE',
@@ -80,6 +91,17 @@ OFLT = {
     '19': '30 ks'
 }
 
+# time-constant settings in seconds
+_TIME_PREFIXES = {'us': 1e-6, 'ms': 1e-3, 's': 1.0, 'ks': 1e3}
+
+
+def _oflt_seconds(label):
+    value, units = label.split()
+    return float(value) * _TIME_PREFIXES[units]
+
+
+OFLT_SECONDS = {key: _oflt_seconds(label) for key, label in OFLT.items()}
+
 # low pass filter slope
 OFSL = {
     '0': '6 dB/oct',
@@ -1,17 +1,28 @@
 import time
+from functools import lru_cache
+
 import numpy as np
 import simpleaudio as sa
 
 
-def beep(freq=440, duration=1, repeat=3, wait_time=0.5):
+@lru_cache(maxsize=8)
+def _make_tone(freq, duration, sample_rate):
     """
-    plays a beep sound
+    synthesizes the int16 sample buffer for a sine tone (cached, since
+    `beep` is called with the same handful of tones over and over)
     """
-    sample_rate = 44100
     t = np.linspace(0, duration, duration * sample_rate, False)
     note = np.sin(freq * t * 2 * np.pi)
     audio = note * (2**15 - 1) / np.max(np.abs(note))
-    audio = audio.astype(np.int16)
+    return audio.astype(np.int16)
+
+
+def beep(freq=440, duration=1, repeat=3, wait_time=0.5):
+    """
+    plays a beep sound
+    """
+    sample_rate = 44100
+    audio = _make_tone(freq, duration, sample_rate)
 
     for i in range(repeat):
         play_obj = sa.play_buffer(audio, 1, 2, sample_rate)
@@ -29,7 +40,7 @@ def freqspace(f_min, f_max, N):
     elif N <= 0:
         raise ValueError("number of elements in frequency range must be an "
                          "integer >= 1")
-    return np.array([f_min * (f_max / f_min)**(i / (N - 1)) for i in range(N)])
+    return np.geomspace(f_min, f_max, N)
 
 
 def printornot(string, disp):
@@ -14,7 +14,6 @@ setup(
     install_requires=["numpy",
                       "pandas",
                       "simpleaudio",
-                      "pyserial",
-                      "datetime"],
+                      "pyserial"],
     zip_safe=False
 )